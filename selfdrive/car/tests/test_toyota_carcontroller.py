@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+import unittest
+
+from selfdrive.car.toyota.carcontroller import SteerLimits, accel_hysteresis, compute_control_surfaces
+from selfdrive.car.toyota.values import MIN_ACC_SPEED, PEDAL_HYST_GAP, CarControllerParams
+
+P = CarControllerParams
+STEER_LIMITS = SteerLimits(P.STEER_MAX, P.STEER_DELTA_UP, P.STEER_DELTA_DOWN, P.STEER_ERROR_MAX)
+
+
+def control_surfaces(enabled=True, gas=0., brake=0., steer=0., v_ego=20., steering_torque_eps=0., steer_state=5,
+                     enable_gas_interceptor=False, use_interceptor=False, accel_steady=0., last_steer=0):
+  return compute_control_surfaces(enabled, gas, brake, steer, v_ego, steering_torque_eps, steer_state,
+                                  enable_gas_interceptor, use_interceptor, accel_steady, last_steer,
+                                  P.ACCEL_HYST_GAP, STEER_LIMITS)
+
+
+class TestToyotaCarController(unittest.TestCase):
+  def test_accel_hysteresis(self):
+    gap = P.ACCEL_HYST_GAP
+    # disabled always sends 0
+    self.assertEqual(accel_hysteresis(0.5, 0.3, False, gap), 0.)
+    # small oscillations within the gap don't change the command
+    self.assertEqual(accel_hysteresis(0.3 + gap / 2, 0.3, True, gap), 0.3)
+    self.assertEqual(accel_hysteresis(0.3 - gap / 2, 0.3, True, gap), 0.3)
+    # outside the gap the command trails the request by the gap
+    self.assertAlmostEqual(accel_hysteresis(0.5, 0.3, True, gap), 0.5 - gap)
+    self.assertAlmostEqual(accel_hysteresis(0.1, 0.3, True, gap), 0.1 + gap)
+
+  def test_accel_steady_returned(self):
+    pcm_accel_cmd = control_surfaces(gas=0.5, accel_steady=0.3)[0]
+    self.assertAlmostEqual(pcm_accel_cmd, 0.5 - P.ACCEL_HYST_GAP)
+    pcm_accel_cmd = control_surfaces(enabled=False, gas=0.5, accel_steady=0.3)[0]
+    self.assertEqual(pcm_accel_cmd, 0.)
+
+  def test_pedal_hysteresis(self):
+    below = MIN_ACC_SPEED - 0.1
+    between = MIN_ACC_SPEED + PEDAL_HYST_GAP / 2
+    above = MIN_ACC_SPEED + PEDAL_HYST_GAP + 0.1
+
+    for use_interceptor in (False, True):
+      # turns on below the min acc speed, off above it plus the gap, otherwise holds
+      self.assertTrue(control_surfaces(v_ego=below, enable_gas_interceptor=True, use_interceptor=use_interceptor)[5])
+      self.assertFalse(control_surfaces(v_ego=above, enable_gas_interceptor=True, use_interceptor=use_interceptor)[5])
+      self.assertEqual(control_surfaces(v_ego=between, enable_gas_interceptor=True, use_interceptor=use_interceptor)[5],
+                       use_interceptor)
+      # untouched without an interceptor
+      self.assertEqual(control_surfaces(v_ego=below, use_interceptor=use_interceptor)[5], use_interceptor)
+
+  def test_interceptor_gas(self):
+    for gas, expected in ((-0.2, 0.), (0.4, 0.4), (1.3, 1.)):
+      pcm_accel_cmd, interceptor_gas_cmd = control_surfaces(gas=gas, brake=0.5, v_ego=0., enable_gas_interceptor=True)[:2]
+      self.assertEqual(interceptor_gas_cmd, expected)
+      # only negative accel is sent to the pcm, with the ABS offset
+      self.assertAlmostEqual(pcm_accel_cmd, 0.06 - 0.5 + P.ACCEL_HYST_GAP)
+
+    # no gas cmd when disengaged or above the interceptor speed
+    self.assertEqual(control_surfaces(enabled=False, gas=0.4, v_ego=0., enable_gas_interceptor=True)[1], 0.)
+    self.assertEqual(control_surfaces(gas=0.4, v_ego=MIN_ACC_SPEED + PEDAL_HYST_GAP + 0.1, enable_gas_interceptor=True)[1], 0.)
+
+  def test_steer_fault_cut(self):
+    for steer_state in (9, 25):
+      apply_steer, apply_steer_req = control_surfaces(steer=0.5, last_steer=100, steering_torque_eps=100,
+                                                      steer_state=steer_state)[2:4]
+      self.assertEqual((apply_steer, apply_steer_req), (0, 0))
+
+    apply_steer, apply_steer_req = control_surfaces(steer=0.5, last_steer=100, steering_torque_eps=100)[2:4]
+    self.assertEqual((apply_steer, apply_steer_req), (100 + P.STEER_DELTA_UP, 1))
+    self.assertEqual(control_surfaces(enabled=False, steer=0.5, last_steer=100, steering_torque_eps=100)[2:4], (0, 0))
+
+  def test_steer_rounding(self):
+    # torque is rounded half away from zero, negative torque mirrors positive
+    for torque, expected in ((-10.35, -10), (-10.65, -11), (-10.5, -11), (10.35, 10), (10.65, 11), (10.5, 11)):
+      apply_steer, _, steer_rate_limited = control_surfaces(steer=torque / P.STEER_MAX, last_steer=expected,
+                                                            steering_torque_eps=expected)[2:5]
+      self.assertEqual(apply_steer, expected)
+      self.assertFalse(steer_rate_limited)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,5 +1,5 @@
+from collections import namedtuple
 from cereal import car
-from common.numpy_fast import clip
 from selfdrive.car import apply_toyota_steer_torque_limits, create_gas_command, make_can_msg
 from selfdrive.car.toyota.toyotacan import create_steer_command, create_ui_command, \
                                            create_accel_command, create_acc_cancel_command, \
@@ -10,23 +10,76 @@ from opendbc.can.packer import CANPacker
 
 VisualAlert = car.CarControl.HUDControl.VisualAlert
 
+STEER_FAULT_STATES = (9, 25)
+STEER_ALERTS = (VisualAlert.steerRequired, VisualAlert.ldw)
 
-def accel_hysteresis(accel, accel_steady, enabled):
+# the subset of CarControllerParams read by apply_toyota_steer_torque_limits
+SteerLimits = namedtuple("SteerLimits", ["STEER_MAX", "STEER_DELTA_UP", "STEER_DELTA_DOWN", "STEER_ERROR_MAX"])
 
-  # for small accel oscillations within ACCEL_HYST_GAP, don't change the accel command
-  if not enabled:
-    # send 0 when disabled, otherwise acc faults
-    accel_steady = 0.
-  elif accel > accel_steady + CarControllerParams.ACCEL_HYST_GAP:
-    accel_steady = accel - CarControllerParams.ACCEL_HYST_GAP
-  elif accel < accel_steady - CarControllerParams.ACCEL_HYST_GAP:
-    accel_steady = accel + CarControllerParams.ACCEL_HYST_GAP
-  accel = accel_steady
 
-  return accel, accel_steady
+def accel_hysteresis(accel, accel_steady, enabled, hyst_gap=CarControllerParams.ACCEL_HYST_GAP):
+  # send 0 when disabled, otherwise acc faults
+  if not enabled:
+    return 0.
+
+  # for small accel oscillations within hyst_gap, don't change the accel command
+  d = accel - accel_steady
+  if d > hyst_gap:
+    return accel - hyst_gap
+  elif d < -hyst_gap:
+    return accel + hyst_gap
+  return accel_steady
+
+
+def compute_control_surfaces(enabled, gas, brake, steer, v_ego, steering_torque_eps, steer_state,
+                             enable_gas_interceptor, use_interceptor, accel_steady, last_steer,
+                             accel_hyst_gap, steer_limits):
+  # scalar control math for one frame, only plain numbers in and out.
+  # returns pcm_accel_cmd (unscaled, also the new accel_steady), interceptor_gas_cmd,
+  # apply_steer, apply_steer_req, steer_rate_limited and use_interceptor
+
+  # gas and brake
+  interceptor_gas_cmd = 0.
+  pcm_accel_cmd = gas - brake
+
+  if enable_gas_interceptor:
+    # handle hysteresis when around the minimum acc speed
+    if v_ego < MIN_ACC_SPEED:
+      use_interceptor = True
+    elif v_ego > MIN_ACC_SPEED + PEDAL_HYST_GAP:
+      use_interceptor = False
+
+    if use_interceptor and enabled:
+      # only send negative accel when using interceptor. gas handles acceleration
+      # +0.06 offset to reduce ABS pump usage when OP is engaged
+      interceptor_gas_cmd = 0. if gas < 0. else 1. if gas > 1. else gas
+      pcm_accel_cmd = 0.06 - brake
+
+  # scaled and clipped to the ACC_CONTROL range when packed
+  pcm_accel_cmd = accel_hysteresis(pcm_accel_cmd, accel_steady, enabled, accel_hyst_gap)
+
+  # steer torque
+  new_steer = steer * steer_limits.STEER_MAX
+  new_steer = int(new_steer + 0.5) if new_steer >= 0 else -int(0.5 - new_steer)
+  apply_steer = apply_toyota_steer_torque_limits(new_steer, last_steer, steering_torque_eps, steer_limits)
+  steer_rate_limited = new_steer != apply_steer
+
+  # Cut steering while we're in a known fault state (2s)
+  steer_req = enabled and steer_state not in STEER_FAULT_STATES
+  apply_steer_req = 1 if steer_req else 0
+  if not steer_req:
+    apply_steer = 0
+
+  return pcm_accel_cmd, interceptor_gas_cmd, apply_steer, apply_steer_req, steer_rate_limited, use_interceptor
 
 
 class CarController():
+  # fixed attribute layout, update() reads most of these every frame
+  __slots__ = ('last_steer', 'last_accel', 'accel_steady', 'alert_active', 'last_standstill', 'standstill_req',
+               'steer_rate_limited', 'use_interceptor', 'accel_hyst_gap', 'steer_limits', 'long_control',
+               'enable_gas_interceptor', 'is_lexus_is', 'is_tss2', 'no_stop_timer', 'fake_ecus', 'has_fwd_camera',
+               'has_dsu', 'static_msgs', 'packer', 'steer_values', 'lta_steer_values', 'accel_values')
+
   def __init__(self, dbc_name, CP, VM):
     self.last_steer = 0
     self.accel_steady = 0.
@@ -36,57 +89,62 @@ class CarController():
     self.steer_rate_limited = False
     self.use_interceptor = False
 
+    # constant for the life of the controller, avoid class attribute lookups every frame
+    p = CarControllerParams
+    self.accel_hyst_gap = p.ACCEL_HYST_GAP
+    self.steer_limits = SteerLimits(p.STEER_MAX, p.STEER_DELTA_UP, p.STEER_DELTA_DOWN, p.STEER_ERROR_MAX)
+
+    # car params don't change after init
+    self.long_control = CP.openpilotLongitudinalControl
+    self.enable_gas_interceptor = CP.enableGasInterceptor
+    self.is_lexus_is = CP.carFingerprint == CAR.LEXUS_IS
+    self.is_tss2 = CP.carFingerprint in TSS2_CAR
+    self.no_stop_timer = CP.carFingerprint in NO_STOP_TIMER_CAR
+
     self.fake_ecus = set()
     if CP.enableCamera:
       self.fake_ecus.add(Ecu.fwdCamera)
     if CP.enableDsu:
       self.fake_ecus.add(Ecu.dsu)
+    self.has_fwd_camera = Ecu.fwdCamera in self.fake_ecus
+    self.has_dsu = Ecu.dsu in self.fake_ecus
+
+    # static msgs sent for this car, filtered once instead of every frame.
+    # keep STATIC_MSGS order, process replay compares sendcan in order
+    self.static_msgs = [(addr, bus, fr_step, vl) for (addr, ecu, cars, bus, fr_step, vl) in STATIC_MSGS
+                        if ecu in self.fake_ecus and CP.carFingerprint in cars]
 
     self.packer = CANPacker(dbc_name)
 
+    # signal dicts for the high rate msgs, filled by the toyotacan create_* functions on
+    # first use and updated in place every frame after that instead of rebuilt
+    self.steer_values = {}
+    self.lta_steer_values = {}
+    self.accel_values = {}
+
   def update(self, enabled, CS, frame, actuators, pcm_cancel_cmd, hud_alert,
              left_line, right_line, lead, left_lane_depart, right_lane_depart):
 
     # *** compute control surfaces ***
 
-    # gas and brake
-    interceptor_gas_cmd = 0.
-    pcm_accel_cmd = actuators.gas - actuators.brake
-
-    if CS.CP.enableGasInterceptor:
-      # handle hysteresis when around the minimum acc speed
-      if CS.out.vEgo < MIN_ACC_SPEED:
-        self.use_interceptor = True
-      elif CS.out.vEgo > MIN_ACC_SPEED + PEDAL_HYST_GAP:
-        self.use_interceptor = False
-
-      if self.use_interceptor and enabled:
-        # only send negative accel when using interceptor. gas handles acceleration
-        # +0.06 offset to reduce ABS pump usage when OP is engaged
-        interceptor_gas_cmd = clip(actuators.gas, 0., 1.)
-        pcm_accel_cmd = 0.06 - actuators.brake
-
-    pcm_accel_cmd, self.accel_steady = accel_hysteresis(pcm_accel_cmd, self.accel_steady, enabled)
-    pcm_accel_cmd = clip(pcm_accel_cmd * CarControllerParams.ACCEL_SCALE, CarControllerParams.ACCEL_MIN, CarControllerParams.ACCEL_MAX)
-
-    # steer torque
-    new_steer = int(round(actuators.steer * CarControllerParams.STEER_MAX))
-    apply_steer = apply_toyota_steer_torque_limits(new_steer, self.last_steer, CS.out.steeringTorqueEps, CarControllerParams)
-    self.steer_rate_limited = new_steer != apply_steer
-
-    # Cut steering while we're in a known fault state (2s)
-    if not enabled or CS.steer_state in [9, 25]:
-      apply_steer = 0
-      apply_steer_req = 0
-    else:
-      apply_steer_req = 1
+    frame_mod_2 = frame % 2
+    frame_mod_3 = frame % 3
+    frame_mod_100 = frame % 100
+
+    CS_out = CS.out
+    pcm_accel_cmd, interceptor_gas_cmd, apply_steer, apply_steer_req, self.steer_rate_limited, self.use_interceptor = \
+      compute_control_surfaces(enabled, actuators.gas, actuators.brake, actuators.steer, CS_out.vEgo,
+                               CS_out.steeringTorqueEps, CS.steer_state, self.enable_gas_interceptor,
+                               self.use_interceptor, self.accel_steady, self.last_steer,
+                               self.accel_hyst_gap, self.steer_limits)
+    self.accel_steady = pcm_accel_cmd
 
     if not enabled and CS.pcm_acc_status:
       # send pcm acc cancel cmd if drive is disabled but pcm is still on, or if the system can't be activated
       pcm_cancel_cmd = 1
 
     # on entering standstill, send standstill request
-    if CS.out.standstill and not self.last_standstill and CS.CP.carFingerprint not in NO_STOP_TIMER_CAR:
+    if CS_out.standstill and not self.last_standstill and not self.no_stop_timer:
       self.standstill_req = True
     if CS.pcm_acc_status != 8:
       # pcm entered standstill or it's disabled
@@ -94,20 +152,21 @@ class CarController():
 
     self.last_steer = apply_steer
     self.last_accel = pcm_accel_cmd
-    self.last_standstill = CS.out.standstill
-
-    can_sends = []
+    self.last_standstill = CS_out.standstill
 
     #*** control msgs ***
     #print("steer {0} {1} {2} {3}".format(apply_steer, min_lim, max_lim, CS.steer_torque_motor)
 
+    # each msg is None when it's not sent this frame
+    steer_msg = lta_msg = accel_msg = gas_msg = ui_msg = fcw_msg = None
+
     # toyota can trace shows this message at 42Hz, with counter adding alternatively 1 and 2;
     # sending it at 100Hz seem to allow a higher rate limit, as the rate limit seems imposed
     # on consecutive messages
-    if Ecu.fwdCamera in self.fake_ecus:
-      can_sends.append(create_steer_command(self.packer, apply_steer, apply_steer_req, frame))
-      if frame % 2 == 0 and CS.CP.carFingerprint in TSS2_CAR:
-        can_sends.append(create_lta_steer_command(self.packer, 0, 0, frame // 2))
+    if self.has_fwd_camera:
+      steer_msg = create_steer_command(self.packer, apply_steer, apply_steer_req, frame, self.steer_values)
+      if frame_mod_2 == 0 and self.is_tss2:
+        lta_msg = create_lta_steer_command(self.packer, 0, 0, frame // 2, self.lta_steer_values)
 
       # LTA mode. Set ret.steerControlType = car.CarParams.SteerControlType.angle and whitelist 0x191 in the panda
       # if frame % 2 == 0:
@@ -115,47 +174,45 @@ class CarController():
       #   can_sends.append(create_lta_steer_command(self.packer, actuators.steeringAngleDeg, apply_steer_req, frame // 2))
 
     # we can spam can to cancel the system even if we are using lat only control
-    if (frame % 3 == 0 and CS.CP.openpilotLongitudinalControl) or (pcm_cancel_cmd and Ecu.fwdCamera in self.fake_ecus):
-      lead = lead or CS.out.vEgo < 12.    # at low speed we always assume the lead is present do ACC can be engaged
+    if (frame_mod_3 == 0 and self.long_control) or (pcm_cancel_cmd and self.has_fwd_camera):
+      lead = lead or CS_out.vEgo < 12.    # at low speed we always assume the lead is present do ACC can be engaged
 
       # Lexus IS uses a different cancellation message
-      if pcm_cancel_cmd and CS.CP.carFingerprint == CAR.LEXUS_IS:
-        can_sends.append(create_acc_cancel_command(self.packer))
-      elif CS.CP.openpilotLongitudinalControl:
-        can_sends.append(create_accel_command(self.packer, pcm_accel_cmd, pcm_cancel_cmd, self.standstill_req, lead))
+      if pcm_cancel_cmd and self.is_lexus_is:
+        accel_msg = create_acc_cancel_command(self.packer)
+      elif self.long_control:
+        accel_msg = create_accel_command(self.packer, pcm_accel_cmd, pcm_cancel_cmd, self.standstill_req, lead,
+                                         self.accel_values)
       else:
-        can_sends.append(create_accel_command(self.packer, 0, pcm_cancel_cmd, False, lead))
+        accel_msg = create_accel_command(self.packer, 0, pcm_cancel_cmd, False, lead, self.accel_values)
 
-    if frame % 2 == 0 and CS.CP.enableGasInterceptor:
+    if frame_mod_2 == 0 and self.enable_gas_interceptor:
       # send exactly zero if gas cmd is zero. Interceptor will send the max between read value and gas cmd.
       # This prevents unexpected pedal range rescaling
-      can_sends.append(create_gas_command(self.packer, interceptor_gas_cmd, frame // 2))
+      gas_msg = create_gas_command(self.packer, interceptor_gas_cmd, frame // 2)
 
     # ui mesg is at 100Hz but we send asap if:
     # - there is something to display
     # - there is something to stop displaying
     fcw_alert = hud_alert == VisualAlert.fcw
-    steer_alert = hud_alert in [VisualAlert.steerRequired, VisualAlert.ldw]
+    steer_alert = hud_alert in STEER_ALERTS
+
+    alert_active = fcw_alert or steer_alert
+    send_ui = alert_active != self.alert_active or bool(pcm_cancel_cmd)  # forcing the pcm to disengage causes a bad fault sound so play a good sound instead
+    self.alert_active = alert_active
 
-    send_ui = False
-    if ((fcw_alert or steer_alert) and not self.alert_active) or \
-       (not (fcw_alert or steer_alert) and self.alert_active):
-      send_ui = True
-      self.alert_active = not self.alert_active
-    elif pcm_cancel_cmd:
-      # forcing the pcm to disengage causes a bad fault sound so play a good sound instead
-      send_ui = True
+    if (frame_mod_100 == 0 or send_ui) and self.has_fwd_camera:
+      ui_msg = create_ui_command(self.packer, steer_alert, pcm_cancel_cmd, left_line, right_line, left_lane_depart, right_lane_depart)
 
-    if (frame % 100 == 0 or send_ui) and Ecu.fwdCamera in self.fake_ecus:
-      can_sends.append(create_ui_command(self.packer, steer_alert, pcm_cancel_cmd, left_line, right_line, left_lane_depart, right_lane_depart))
+    if frame_mod_100 == 0 and self.has_dsu:
+      fcw_msg = create_fcw_command(self.packer, fcw_alert)
 
-    if frame % 100 == 0 and Ecu.dsu in self.fake_ecus:
-      can_sends.append(create_fcw_command(self.packer, fcw_alert))
+    can_sends = [m for m in (steer_msg, lta_msg, accel_msg, gas_msg, ui_msg, fcw_msg) if m is not None]
 
     #*** static msgs ***
 
-    for (addr, ecu, cars, bus, fr_step, vl) in STATIC_MSGS:
-      if frame % fr_step == 0 and ecu in self.fake_ecus and CS.CP.carFingerprint in cars:
+    for (addr, bus, fr_step, vl) in self.static_msgs:
+      if frame % fr_step == 0:
         can_sends.append(make_can_msg(addr, vl, bus))
 
     return can_sends
@@ -1,45 +1,65 @@
-def create_steer_command(packer, steer, steer_req, raw_cnt):
-  """Creates a CAN message for the Toyota Steer Command."""
+from common.numpy_fast import clip
+from selfdrive.car.toyota.values import CarControllerParams
 
-  values = {
-    "STEER_REQUEST": steer_req,
-    "STEER_TORQUE_CMD": steer,
-    "COUNTER": raw_cnt,
-    "SET_ME_1": 1,
-  }
+
+def create_steer_command(packer, steer, steer_req, raw_cnt, values=None):
+  """Creates a CAN message for the Toyota Steer Command.
+
+  A dict passed as values is filled on first use and then updated in place, so
+  callers sending this every frame can keep reusing it."""
+
+  if values is None:
+    values = {}
+  if not values:
+    values["SET_ME_1"] = 1
+  values["STEER_REQUEST"] = steer_req
+  values["STEER_TORQUE_CMD"] = steer
+  values["COUNTER"] = raw_cnt
   return packer.make_can_msg("STEERING_LKA", 0, values)
 
 
-def create_lta_steer_command(packer, steer, steer_req, raw_cnt):
-  """Creates a CAN message for the Toyota LTA Steer Command."""
+def create_lta_steer_command(packer, steer, steer_req, raw_cnt, values=None):
+  """Creates a CAN message for the Toyota LTA Steer Command.
 
-  values = {
-    "COUNTER": raw_cnt + 128,
-    "SETME_X1": 1,
-    "SETME_X3": 3,
-    "PERCENTAGE": 100,
-    "SETME_X64": 0x64,
-    "ANGLE": 0,  # Rate limit? Lower values seeem to work better, but needs more testing
-    "STEER_ANGLE_CMD": steer,
-    "STEER_REQUEST": steer_req,
-    "STEER_REQUEST_2": steer_req,
-    "BIT": 0,
-  }
+  values is reused the same way as in create_steer_command."""
+
+  if values is None:
+    values = {}
+  if not values:
+    values.update({
+      "SETME_X1": 1,
+      "SETME_X3": 3,
+      "PERCENTAGE": 100,
+      "SETME_X64": 0x64,
+      "ANGLE": 0,  # Rate limit? Lower values seeem to work better, but needs more testing
+      "BIT": 0,
+    })
+  values["COUNTER"] = raw_cnt + 128
+  values["STEER_ANGLE_CMD"] = steer
+  values["STEER_REQUEST"] = steer_req
+  values["STEER_REQUEST_2"] = steer_req
   return packer.make_can_msg("STEERING_LTA", 0, values)
 
 
-def create_accel_command(packer, accel, pcm_cancel, standstill_req, lead):
-  # TODO: find the exact canceling bit that does not create a chime
-  values = {
-    "ACCEL_CMD": accel,
-    "SET_ME_X01": 1,
-    "DISTANCE": 0,
-    "MINI_CAR": lead,
-    "SET_ME_X3": 3,
-    "PERMIT_BRAKING": 1,
-    "RELEASE_STANDSTILL": not standstill_req,
-    "CANCEL_REQ": pcm_cancel,
-  }
+def create_accel_command(packer, accel, pcm_cancel, standstill_req, lead, values=None):
+  # accel is the unscaled command, scale it to m/s2 and clip to the allowed range
+  accel = clip(accel * CarControllerParams.ACCEL_SCALE, CarControllerParams.ACCEL_MIN, CarControllerParams.ACCEL_MAX)
+
+  # values is reused the same way as in create_steer_command
+  if values is None:
+    values = {}
+  if not values:
+    # TODO: find the exact canceling bit that does not create a chime
+    values.update({
+      "SET_ME_X01": 1,
+      "DISTANCE": 0,
+      "SET_ME_X3": 3,
+      "PERMIT_BRAKING": 1,
+    })
+  values["ACCEL_CMD"] = accel
+  values["MINI_CAR"] = lead
+  values["RELEASE_STANDSTILL"] = not standstill_req
+  values["CANCEL_REQ"] = pcm_cancel
   return packer.make_can_msg("ACC_CONTROL", 0, values)
 
 